@@ -0,0 +1,161 @@
+import asyncio
+from io import BytesIO
+
+import httpx
+from lxml import etree as ET
+
+from translate import AIMDLimiter, ITextCollector, ScribusTranslator, TranslatedWriter
+
+
+def body_size(translator: ScribusTranslator, batch: list) -> int:
+    data = {'text': batch, 'target_lang': 'FR', 'source_lang': 'EN'}
+    return len(httpx.Request('POST', translator._translate_url, data=data).content)
+
+
+def test_oversized_text_gets_its_own_batch():
+    translator = ScribusTranslator('key')
+    big_text = 'x' * 200_000
+
+    batches = translator.make_batches(['short', big_text, 'short'])
+
+    assert batches == [['short'], [big_text], ['short']]
+
+
+def test_batches_respect_count_and_size_limits():
+    translator = ScribusTranslator('key')
+    texts = ([f"text {i}" for i in range(120)] + ['é' * 10_000 for _ in range(30)] + ['x' * 60_000, 'y' * 60_000]
+             + ['z' * 49_989, 'z' * 49_989])
+
+    batches = translator.make_batches(texts)
+
+    assert [text for batch in batches for text in batch] == texts
+    for batch in batches:
+        assert len(batch) <= translator.max_batch_texts
+        assert body_size(translator, batch) <= translator.max_batch_bytes
+
+
+def test_missing_translations_fail_the_request():
+    translator = ScribusTranslator('key')
+    translator._limiter = AIMDLimiter()
+
+    def handler(request):
+        return httpx.Response(200, json={'translations': [{'text': 'un'}]})
+
+    async def translate():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            translator._client = client
+            return await translator.translate_texts(['one', 'two'], 'FR')
+
+    assert asyncio.run(translate()) is None
+
+
+DELIMITER = '␞'
+
+
+def collect(xml: str, max_pack_chars: int = 200) -> ITextCollector:
+    collector = ITextCollector(DELIMITER, 3, max_pack_chars)
+    return ET.fromstring(xml, ET.XMLParser(target=collector))
+
+
+def test_adjacent_short_runs_are_packed():
+    collector = collect('<StoryText><ITEXT CH="a"/><ITEXT CH=" b "/><ITEXT CH="c"/></StoryText>')
+
+    packed_text = f"a{DELIMITER} b {DELIMITER}c"
+    assert collector.packed_texts == {packed_text: ['a', ' b ', 'c']}
+    assert collector.packing == {0: (packed_text, 0), 1: (packed_text, 1), 2: (packed_text, 2)}
+    assert collector.pop_new_texts() == [packed_text]
+
+
+def test_runs_are_only_packed_when_adjacent():
+    collector = collect('<StoryText><ITEXT CH="a"/><ITEXT CH="b"/><para/><ITEXT CH="c"/><ITEXT CH="d"/>'
+                        '<ITEXT CH="long text"/><ITEXT CH="e"/><ITEXT CH=" "/><ITEXT CH="f"/><trail/></StoryText>')
+
+    assert list(collector.packed_texts) == [f"a{DELIMITER}b", f"c{DELIMITER}d"]
+    # A single run between other tags is translated as a plain text
+    assert collector.pop_new_texts() == [f"a{DELIMITER}b", f"c{DELIMITER}d", 'long text', 'e', 'f']
+    assert collector.total == 8
+
+
+def test_texts_containing_the_delimiter_are_not_packed():
+    collector = collect(f'<StoryText><ITEXT CH="a"/><ITEXT CH="b{DELIMITER}"/><ITEXT CH="c"/></StoryText>')
+
+    assert collector.packed_texts == {}
+    assert collector.pop_new_texts() == ['a', f"b{DELIMITER}", 'c']
+
+
+def test_packed_texts_respect_max_pack_chars():
+    runs = [f"{i:03}" for i in range(150)]
+    xml = '<StoryText>' + ''.join(f'<ITEXT CH="{run}"/>' for run in runs) + '</StoryText>'
+    collector = ITextCollector(DELIMITER, 3, 200)
+    parser = ET.XMLParser(target=collector)
+
+    # The packing of every ITEXT before decided must be known while the file is parsed in chunks
+    for start in range(0, len(xml), 20):
+        parser.feed(xml[start:start + 20])
+        assert all(index in collector.packing for index in range(collector.decided))
+    parser.close()
+
+    assert collector.decided == 150
+    assert [run for packed_text in collector.packed_texts for run in collector.packed_texts[packed_text]] == runs
+    for packed_text in collector.packed_texts:
+        assert len(packed_text) <= 200
+
+
+def test_writer_only_changes_the_translated_texts():
+    xml = ('<SCRIBUSUTF8NEW Version="1.6"><!-- comment --><?pi data?><DOCUMENT>\n'
+           '  <StoryText><ITEXT CH="hello" FONT="Arial"/><para/><ITEXT CH=""/><ITEXT CH="  "/></StoryText>\n'
+           '  <MASTERPAGE NAM="A">text &amp; tail</MASTERPAGE>\n'
+           '</DOCUMENT></SCRIBUSUTF8NEW>')
+    output = BytesIO()
+    reported = []
+
+    async def get_translation(index: int, text: str) -> str:
+        return text.upper()
+
+    async def write():
+        with ET.xmlfile(output, encoding='utf-8') as xf:
+            writer = TranslatedWriter(xf, get_translation, lambda text, translation: reported.append(text))
+            ET.fromstring(xml, ET.XMLParser(target=writer))
+            await writer.write_events()
+
+    asyncio.run(write())
+
+    expected = ET.fromstring(xml)
+    expected.find('.//ITEXT').set('CH', 'HELLO')
+    assert ET.tostring(ET.fromstring(output.getvalue()), method='c14n') == ET.tostring(expected, method='c14n')
+    assert reported == ['hello', '', '  ']
+
+
+def translate_story(tmp_path, runs: list, translate) -> tuple:
+    input_file = tmp_path / 'input.sla'
+    output_file = tmp_path / 'output.sla'
+    input_file.write_text('<StoryText>' + ''.join(f'<ITEXT CH="{run}"/>' for run in runs) + '</StoryText>')
+    translator = ScribusTranslator('key')
+    requests = []
+
+    async def translate_texts(texts: list, target_lang: str, source_lang: str = None) -> list:
+        requests.append(texts)
+        return [translate(text) for text in texts]
+
+    translator.translate_texts = translate_texts
+    asyncio.run(translator.translate_file(str(input_file), str(output_file), 'FR'))
+
+    return [itext.get('CH') for itext in ET.parse(str(output_file)).iter('ITEXT')], requests
+
+
+def test_packed_runs_keep_their_spaces(tmp_path):
+    # DeepL moves the spaces around the delimiters
+    def translate(text):
+        return f" {DELIMITER} ".join(part.strip().upper() for part in text.split(DELIMITER))
+
+    translated, requests = translate_story(tmp_path, ['a ', ' b', 'c'], translate)
+
+    assert translated == ['A ', ' B', 'C']
+    assert requests == [[f"a {DELIMITER} b{DELIMITER}c"]]
+
+
+def test_runs_are_translated_one_by_one_when_a_delimiter_is_dropped(tmp_path):
+    translated, requests = translate_story(tmp_path, ['a ', ' b', 'c'], lambda text: text.replace(DELIMITER, '').upper())
+
+    assert translated == ['A ', ' B', 'C']
+    assert requests == [[f"a {DELIMITER} b{DELIMITER}c"], ['a ', ' b', 'c']]
@@ -1,10 +1,336 @@
 import argparse
+import asyncio
+import random
+import sqlite3
+import shutil
 import sys
+import tempfile
 import time
-import xml.etree.ElementTree as ET
-import requests
+import httpx
 import os
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from hashlib import blake2b
+from lxml import etree as ET
 from pathlib import Path
+from urllib.parse import quote_plus
+
+# orjson decodes the API responses faster, the standard json module is used when it is not installed
+try:
+    import orjson as json
+except ImportError:
+    import json
+
+class TranslationCache:
+    def __init__(self, path: str = '~/.cache/scribus-translator.sqlite'):
+        """
+        Persistent cache of translations, stored in a SQLite database
+        
+        Parameters:
+            path (str): Path to the SQLite database
+        """
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        # WAL lets several translator processes share the cache
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS translations '
+                                    '(key TEXT PRIMARY KEY, translation TEXT NOT NULL, created REAL NOT NULL)')
+
+    def make_key(self, text: str, target_lang: str, source_lang: str = None) -> str:
+        """
+        Get the cache key of a text translation
+        
+        Parameters:
+            text (str): Text to translate
+            target_lang (str): Target language code
+            source_lang (str): Source language code
+            
+        Returns:
+            str: Cache key
+        """
+        key = f"{source_lang or ''}|{target_lang}|{text}"
+        return blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+    def get(self, texts: list, target_lang: str, source_lang: str = None) -> dict:
+        """
+        Get the cached translations of texts
+        
+        Parameters:
+            texts (list): Texts to look up
+            target_lang (str): Target language code
+            source_lang (str): Source language code
+            
+        Returns:
+            dict: Translations of the cached texts, by text
+        """
+        keys = {self.make_key(text, target_lang, source_lang): text for text in texts}
+        translations = {}
+        key_list = list(keys)
+        # Stay below SQLite limit of host parameters per query
+        for start in range(0, len(key_list), 500):
+            chunk = key_list[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.connection.execute(f'SELECT key, translation FROM translations WHERE key IN ({placeholders})', chunk)
+            for key, translation in rows:
+                translations[keys[key]] = translation
+
+        return translations
+
+    def set(self, translations: dict, target_lang: str, source_lang: str = None):
+        """
+        Store translations in the cache
+        
+        Parameters:
+            translations (dict): Translations, by text
+            target_lang (str): Target language code
+            source_lang (str): Source language code
+        """
+        now = time.time()
+        rows = [(self.make_key(text, target_lang, source_lang), translation, now) for text, translation in translations.items()]
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO translations (key, translation, created) VALUES (?, ?, ?)', rows)
+
+    def close(self):
+        self.connection.close()
+
+class AIMDLimiter:
+    def __init__(self, min_limit: int = 1, max_limit: int = 16, increase: float = 0.5, decrease: float = 0.5,
+                 target_latency: float = 2.0, window: int = 20):
+        """
+        Limit the number of concurrent requests, adapting the limit with additive increase
+        and multiplicative decrease (AIMD), like TCP congestion control:
+        the limit grows by `increase` after each success while the mean latency stays
+        below `target_latency`, and is multiplied by `decrease` when the server is overloaded.
+        
+        Parameters:
+            min_limit (int): Minimum number of concurrent requests
+            max_limit (int): Maximum number of concurrent requests
+            increase (float): Additive increase of the limit on success
+            decrease (float): Multiplicative decrease of the limit on overload
+            target_latency (float): Mean latency in seconds above which the limit stops growing
+            window (int): Number of latencies used to compute the mean latency
+        """
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self.limit = float(min_limit)
+        # Time of the last decrease, failed requests sent before it don't decrease the limit again
+        self.decreased_at = float('-inf')
+        self.in_flight = 0
+        self.latencies = deque(maxlen=window)
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float):
+        """
+        Record the latency of a successful request and increase the limit if the server keeps up
+        
+        Parameters:
+            latency (float): Request latency in seconds
+        """
+        self.latencies.append(latency)
+        if sum(self.latencies) / len(self.latencies) <= self.target_latency:
+            self.limit = min(self.max_limit, self.limit + self.increase)
+
+    def on_overload(self, started_at: float):
+        """
+        Decrease the limit after a rate limit, an unavailable server, a timeout or a connection error.
+        Like TCP, the limit is decreased once per congestion event: the failures of requests sent
+        before the last decrease are part of the same event and are ignored
+
+        Parameters:
+            started_at (float): time.monotonic() value when the failed request was sent
+        """
+        if started_at < self.decreased_at:
+            return
+
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        self.decreased_at = time.monotonic()
+
+class ITextCollector:
+    def __init__(self, pack_delimiter: str, max_short_chars: int, max_pack_chars: int):
+        """
+        XML parser target collecting the ITEXT texts without building the document tree.
+        Empty texts are only counted in the total, they are kept as is without calling the API.
+        Adjacent short ITEXT runs of a StoryText (single glyphs split by formatting) are joined by
+        pack_delimiter into a single packed text, translated with the context of its neighbours
+        
+        Parameters:
+            pack_delimiter (str): Character joining the packed runs
+            max_short_chars (int): Maximum length of a run to be packed, leading and trailing spaces excluded
+            max_pack_chars (int): Maximum length of a packed text
+        """
+        self.pack_delimiter = pack_delimiter
+        self.max_short_chars = max_short_chars
+        self.max_pack_chars = max_pack_chars
+        self.total = 0
+        self.texts = set()
+        # Texts seen for the first time since the last call of pop_new_texts
+        self.new_texts = []
+        # Runs of each packed text, and packed text and part of each packed ITEXT by index
+        self.packed_texts = {}
+        self.packing = {}
+        # Indexes and texts of the adjacent short runs not packed yet
+        self.runs = []
+        self.runs_size = 0
+        # All ITEXT tags before this index have been collected and their packing is known
+        self.decided = 0
+        self.finished = False
+
+    def add_text(self, text: str):
+        if text not in self.texts:
+            self.texts.add(text)
+            self.new_texts.append(text)
+
+    def pack_runs(self):
+        if len(self.runs) > 1:
+            packed_text = self.pack_delimiter.join(text for _, text in self.runs)
+            self.packed_texts[packed_text] = [text for _, text in self.runs]
+            for part, (index, _) in enumerate(self.runs):
+                self.packing[index] = (packed_text, part)
+            self.add_text(packed_text)
+        elif self.runs:
+            self.add_text(self.runs[0][1])
+        self.runs = []
+        self.runs_size = 0
+        self.decided = self.total
+
+    def start(self, tag: str, attrib: dict):
+        if tag != 'ITEXT':
+            self.pack_runs()
+            return
+
+        index = self.total
+        self.total += 1
+        text = attrib.get('CH', '')
+        core = text.strip()
+        # Texts containing the delimiter could not be split back
+        if 0 < len(core) <= self.max_short_chars and self.pack_delimiter not in text:
+            if self.runs_size + len(text) > self.max_pack_chars:
+                self.pack_runs()
+                # This ITEXT starts the new runs, its packing is not known yet
+                self.decided = index
+            self.runs.append((index, text))
+            self.runs_size += len(text) + len(self.pack_delimiter)
+            return
+
+        self.pack_runs()
+        if core:
+            self.add_text(text)
+
+    def end(self, tag: str):
+        # The runs of a StoryText are only packed together when nothing but ITEXT tags separates them
+        if tag != 'ITEXT':
+            self.pack_runs()
+
+    def pop_new_texts(self) -> list:
+        """
+        Get the texts seen for the first time since the last call
+        
+        Returns:
+            list: New texts, in document order
+        """
+        new_texts, self.new_texts = self.new_texts, []
+        return new_texts
+
+    def close(self):
+        self.pack_runs()
+        self.finished = True
+        return self
+
+class TranslatedWriter:
+    def __init__(self, xf: ET.xmlfile, get_translation, report):
+        """
+        XML parser target writing the parsed document to an incremental XML writer,
+        replacing the CH attribute of ITEXT tags by its translation.
+        Parse events are buffered until write_events is awaited, which waits for the missing translations
+        
+        Parameters:
+            xf (ET.xmlfile): Incremental XML writer of the output file
+            get_translation (callable): Coroutine function giving the translation of an ITEXT tag from its index and text
+            report (callable): Called with the text and the translation of each written ITEXT tag
+        """
+        self.xf = xf
+        self.get_translation = get_translation
+        self.report = report
+        self.events = []
+        self.index = 0
+        self.elements = []
+        # Start tag waiting for the next event, to write empty elements as self-closing tags
+        self.pending = None
+
+    def start(self, tag: str, attrib: dict):
+        self.events.append((self.write_start, tag, attrib))
+
+    def end(self, tag: str):
+        self.events.append((self.write_end, tag))
+
+    def data(self, data: str):
+        self.events.append((self.write_node, data))
+
+    def comment(self, text: str):
+        self.events.append((self.write_node, ET.Comment(text)))
+
+    def pi(self, target: str, data: str):
+        self.events.append((self.write_node, ET.PI(target, data)))
+
+    def close(self):
+        return None
+
+    async def write_events(self):
+        """
+        Write the buffered parse events, waiting for the translation of each ITEXT tag
+        """
+        events, self.events = self.events, []
+        for write, *args in events:
+            if write == self.write_start and args[0] == 'ITEXT':
+                tag, attrib = args
+                text = attrib.get('CH', '')
+                translation = await self.get_translation(self.index, text)
+                self.index += 1
+                if text.strip():
+                    # The parser gives a new attributes dict for each tag, it can be updated without a copy
+                    attrib['CH'] = translation
+                self.report(text, translation)
+                args = (tag, attrib)
+            write(*args)
+
+    def write_pending(self):
+        if self.pending is not None:
+            element = self.xf.element(*self.pending)
+            element.__enter__()
+            self.elements.append(element)
+            self.pending = None
+
+    def write_start(self, tag: str, attrib: dict):
+        self.write_pending()
+        self.pending = (tag, attrib)
+
+    def write_end(self, tag: str):
+        if self.pending is not None:
+            self.xf.write(ET.Element(*self.pending))
+            self.pending = None
+        else:
+            self.elements.pop().__exit__(None, None, None)
+
+    def write_node(self, node):
+        self.write_pending()
+        self.xf.write(node)
 
 class ScribusTranslator:
     def __init__(self, api_key: str):
@@ -17,11 +343,39 @@ class ScribusTranslator:
         self.api_key = api_key
         self.source_language = None
         self.target_language = 'EN'
-        self.base_url = "https://api-free.deepl.com/"
+        self.base_url = "https://api-free.deepl.com"
         self.endpoints = {"translate" : "/v2/translate",
                           "languages" : "/v2/languages"}
         self.max_retries = 5
         self.retry_delay = 1
+        self.max_retry_delay = 30
+        self.max_batch_texts = 50
+        # Safety margin below the 128 KiB request size limit of DeepL
+        self.max_batch_bytes = 100_000
+        # Part of max_batch_bytes kept for the target_lang and source_lang fields of the body
+        self.batch_fields_bytes = 64
+        # Adjacent ITEXT runs of at most max_short_chars are joined by an unlikely character,
+        # up to max_pack_chars, and translated as one text
+        self.pack_delimiter = '\u241e'
+        self.max_short_chars = 3
+        self.max_pack_chars = 200
+        self.concurrency = 16
+        self.queue_size = 200
+        self.read_size = 1024 * 1024
+        self.progress_interval = 100
+        # URLs and headers are built once instead of on every request
+        self._translate_url = self.get_full_url('translate')
+        self._languages_url = self.get_full_url('languages')
+        self._auth_header = {'Authorization': f'DeepL-Auth-Key {api_key}'}
+        # Synchronous session reused by the language lookups, the translations use their own async client
+        self._session = httpx.Client(headers=self._auth_header,
+                                     limits=httpx.Limits(max_connections=20, max_keepalive_connections=20))
+        self._languages = {}
+        self._client = None
+        self._limiter = None
+        self._http_version = None
+        self._resume_at = 0.0
+        self.cache = None
         self.chars_translated = 0
     
     def get_full_url(self, endpoint: str):
@@ -60,7 +414,7 @@ class ScribusTranslator:
     
     def get_supported_languages(self, type: str = 'target') -> list:
         """
-        Get supported languages from DeepL API
+        Get supported languages from DeepL API, the result is kept for the next calls
 
         Parameters:
             type (str): Language type ('source' or 'target')
@@ -68,61 +422,199 @@ class ScribusTranslator:
             list: List of supported languages
         """
 
+        if type in self._languages:
+            return self._languages[type]
+
         params = {
             'type': type 
         }
-
-        headers = {
-            'Authorization': f'DeepL-Auth-Key {self.api_key}'
-        }
         
-        response = requests.get(self.get_full_url("languages"), params=params, headers=headers)
+        response = self._session.get(self._languages_url, params=params)
         if response.status_code == 200:
-            languages = response.json()
+            languages = json.loads(response.content)
+            self._languages[type] = languages
             return languages
         else:
             print(f"Error getting supported languages: {response.status_code}")
             return None
         
         
-    def translate_text(self, text: str, target_lang: str, source_lang: str = None) -> str:
+    async def translate_texts(self, texts: list, target_lang: str, source_lang: str = None) -> list:
         """
-        Translate text using DeepL API
+        Translate a batch of texts using DeepL API in a single request
         
         Parameters:
-            text (str): Text to translate
+            texts (list): Texts to translate
             target_lang (str): Target language code
+            source_lang (str): Source language code
             
         Returns:
-            str: Translated text
+            list: Translated texts, in the same order as the input texts
         """
-        if not text.strip():
-            return text
-        
-        params = {
-            'auth_key': self.api_key,
-            'text': text,
+        # Texts are sent form-encoded in the body, an URL could not hold large batches
+        data = {
+            'text': texts,
             'target_lang': target_lang
         }
 
         if source_lang is not None:
-            params['source_lang'] = source_lang
+            data['source_lang'] = source_lang
         
-        response = requests.post(self.get_full_url('translate'), params=params)
+        # Wait while the server asked to pause the requests
+        while (delay := self._resume_at - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+        async with self._limiter:
+            start = time.monotonic()
+            try:
+                response = await self._client.post(self._translate_url, data=data)
+            except httpx.TransportError as error:
+                # Timeouts and connection errors (refused, reset, HTTP/2 GOAWAY...) are retried like a 503
+                self._limiter.on_overload(start)
+                print(f"Error translating texts: {type(error).__name__} {error}", file=sys.stderr)
+                return None
+
+            if response.status_code == 200:
+                self._limiter.on_success(time.monotonic() - start)
+            elif response.status_code in (429, 503):
+                self._limiter.on_overload(start)
+
+        self.update_rate_limit(response)
+
+        if self._http_version is None:
+            self._http_version = response.http_version
+            if self._http_version != 'HTTP/2':
+                print(f"HTTP/2 not negotiated with DeepL API, using {self._http_version}", file=sys.stderr)
         
         if response.status_code == 200:
-            return response.json()['translations'][0]['text']
+            translated = [translation['text'] for translation in json.loads(response.content)['translations']]
+            if len(translated) != len(texts):
+                # Pairing the texts with fewer or more translations would misplace or drop them
+                print(f"Error translating texts: {len(translated)} translations for {len(texts)} texts", file=sys.stderr)
+                return None
+            return translated
         else:
-            print(f"Error translating text: {response.status_code}", file=sys.stderr)
+            print(f"Error translating texts: {response.status_code}", file=sys.stderr)
+            return None
+
+    def parse_retry_after(self, value: str) -> float:
+        """
+        Parse a Retry-After header, given either as a number of seconds or as an HTTP date
+        
+        Parameters:
+            value (str): Header value
+            
+        Returns:
+            float: Delay in seconds, None if the value is missing or invalid
+        """
+        if value is None:
             return None
+
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+
+        return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+    def update_rate_limit(self, response: httpx.Response):
+        """
+        Pause all requests according to the rate limit headers of the response:
+        Retry-After on 429/503, or X-RateLimit-Reset when less than 10% of the quota remains
+        
+        Parameters:
+            response (httpx.Response): DeepL API response
+        """
+        delay = None
+        if response.status_code in (429, 503):
+            delay = self.parse_retry_after(response.headers.get('Retry-After'))
+            if delay is not None:
+                # Jitter avoids all pending requests hitting the server at once
+                delay += random.random()
+
+        try:
+            remaining = int(response.headers['X-RateLimit-Remaining'])
+            limit = int(response.headers['X-RateLimit-Limit'])
+            reset = float(response.headers['X-RateLimit-Reset'])
+        except (KeyError, ValueError):
+            pass
+        else:
+            if remaining < 0.1 * limit:
+                # The reset is given either as an epoch timestamp or as a delay in seconds
+                if reset > 1e9:
+                    reset -= time.time()
+                delay = max(delay or 0.0, reset)
+
+        if delay is not None:
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+    def retry_wait(self, retry_count: int) -> float:
+        """
+        Get the delay before retrying a failed request: the pause asked by the server if any,
+        otherwise an exponential backoff with a jitter of +/- 50% so that concurrent batches do not retry in lockstep
+        
+        Parameters:
+            retry_count (int): Number of retries already done
+            
+        Returns:
+            float: Delay in seconds
+        """
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            return delay
+
+        return min(self.max_retry_delay, self.retry_delay * 2 ** retry_count) * (0.5 + random.random())
+
+    def make_batches(self, texts: list) -> list:
+        """
+        Split texts into batches respecting DeepL limits on texts count and payload size per request.
+        The size of a text is the one of its form-encoded 'text' field, as sent in the request body,
+        batch_fields_bytes are kept for the other fields and a text larger than the limit is sent alone
+        
+        Parameters:
+            texts (list): Texts to split
             
-    def translate_file(self, input_file: str, output_file: str, target_lang, source_lang :str = None):
+        Returns:
+            list: List of batches of texts
         """
-        Read XML file, replace CH attribute with 'toto' in all ITEXT tags and save the result.
+        batches = []
+        batch = []
+        batch_size = self.batch_fields_bytes
+        for text in texts:
+            text_size = len('&text=') + len(quote_plus(text))
+            if batch and (len(batch) >= self.max_batch_texts or batch_size + text_size > self.max_batch_bytes):
+                batches.append(batch)
+                batch = []
+                batch_size = self.batch_fields_bytes
+            batch.append(text)
+            batch_size += text_size
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+            
+    async def translate_file(self, input_file: str, output_file: str, target_lang, source_lang :str = None):
+        """
+        Read Scribus file, translate CH attribute of all ITEXT tags and save the result.
+        Parsing, translation and writing run as a pipeline: texts are queued for translation as soon as
+        they are parsed, and the output file is written as soon as the translations are available.
+        Batches are sent concurrently, the number of requests in flight adapts to the server load
+        up to self.concurrency.
         
         Parameters:
             input_file (str): Path to the input XML file
-            output_file (str, optional): Path to save modified XML. If None, overwrites input file
+            output_file (str): Path to save translated XML
+            target_lang (str): Target language code
+            source_lang (str, optional): Source language code
         """
         # Convert to Path object for better path handling
         input_path = Path(input_file)
@@ -130,39 +622,182 @@ class ScribusTranslator:
         # Check if input file exists
         if not input_path.exists():
             raise FileNotFoundError(f"Input file not found: {input_file}")
-                
-        # Parse XML file
-        tree = ET.parse(input_path)
-        root = tree.getroot()
-        
-        # Find all ITEXT elements and modify their CH attribute
-        total_texts = len(root.findall('.//ITEXT'))
+
+        # The file is parsed twice with parser targets so that the document tree is never built in memory:
+        # once to collect the texts to translate, once to write the translated document.
+        # huge_tree is needed for the images embedded in Scribus files
+        collector = ITextCollector(self.pack_delimiter, self.max_short_chars, self.max_pack_chars)
+        parsed = asyncio.Condition()
+        translations = {}
+        packed_translations = {}
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        loop = asyncio.get_running_loop()
         count = 0
-        for itext in root.findall('.//ITEXT'):
-            text_info = {
-                'element': itext,
-                'text': itext.get('CH', ''),
-                'attributes': dict(itext.attrib)
-            }
+
+        def get_future(futures: dict, text: str) -> asyncio.Future:
+            if text not in futures:
+                futures[text] = loop.create_future()
+            return futures[text]
+
+        def set_future(futures: dict, text: str, result):
+            future = get_future(futures, text)
+            if not future.done():
+                future.set_result(result)
+
+        def apply_translation(text: str, translation: str) -> bool:
+            set_future(translations, text, translation)
+            if text not in collector.packed_texts:
+                return True
+
+            runs = collector.packed_texts[text]
+            parts = translation.split(self.pack_delimiter)
+            if len(parts) != len(runs):
+                return False
+
+            # DeepL may move the spaces around the delimiters, each part gets the spaces of its original run
+            for i, (run, part) in enumerate(zip(runs, parts)):
+                parts[i] = run[:len(run) - len(run.lstrip())] + part.strip() + run[len(run.rstrip()):]
+            set_future(packed_translations, text, parts)
+            return True
+
+        async def get_translation(index: int, text: str) -> str:
+            # Wait until the collector knows whether this ITEXT tag is packed with the next ones
+            if collector.decided <= index:
+                async with parsed:
+                    await parsed.wait_for(lambda: collector.decided > index)
+
+            packing = collector.packing.pop(index, None)
+            if packing is not None:
+                packed_text, part = packing
+                return (await get_future(packed_translations, packed_text))[part]
+
+            if not text.strip():
+                return text
+
+            return await get_future(translations, text)
+
+        def report(text: str, translation: str):
+            nonlocal count
+            count += 1
+            # Printing every text slows down large files, the progress is only printed every progress_interval texts.
+            # The total, and so the percentage, is only known once the whole file is parsed
+            if count % self.progress_interval == 0:
+                if collector.finished:
+                    print(f"{text} -> {translation} : {count}/{collector.total} texts: {count * 100 / collector.total:.2f}%")
+                else:
+                    print(f"{text} -> {translation} : {count} texts")
+
+        async def parse(parser: ET.XMLParser, on_chunk):
+            with open(input_path, 'rb') as file:
+                while chunk := await asyncio.to_thread(file.read, self.read_size):
+                    parser.feed(chunk)
+                    await on_chunk()
+            parser.close()
+            await on_chunk()
+
+        async def queue_new_texts():
+            async with parsed:
+                parsed.notify_all()
+
+            texts = collector.pop_new_texts()
+            # Cached translations are applied directly, only the others are sent to DeepL
+            if self.cache is not None and texts:
+                cached = self.cache.get(texts, target_lang, source_lang)
+                texts = [text for text in texts if text not in cached or not apply_translation(text, cached[text])]
+            for text in texts:
+                await queue.put(text)
+
+        async def produce():
+            await parse(ET.XMLParser(target=collector, huge_tree=True), queue_new_texts)
+            # End of the texts, each consumer puts it back for the others
+            await queue.put(None)
+
+        async def translate_batch(texts: list):
             retry_count = 0
-            translated = self.translate_text(text_info['text'], target_lang)
+            translated = await self.translate_texts(texts, target_lang, source_lang)
 
-            while translated is None and retry_count < self.max_retry:
+            while translated is None and retry_count < self.max_retries:
+                delay = self.retry_wait(retry_count)
                 retry_count += 1
-                print(f"Retrying translation for text: {text_info['text']} (retry {retry_count}/{self.max_retry})")
-                time.sleep(self.retry_delay)
-                translated = self.translate_text(text_info['text'], target_lang, source_lang)
+                print(f"Retrying translation for {len(texts)} texts (retry {retry_count}/{self.max_retries})")
+                await asyncio.sleep(delay)
+                translated = await self.translate_texts(texts, target_lang, source_lang)
 
             if translated is None:
-                print(f"Failed to translate text: {text_info['text']} after {self.max_retry} retries, original text will be used")
-                translated = text_info['text']
+                print(f"Failed to translate {len(texts)} texts after {self.max_retries} retries, original texts will be used")
+                for text in texts:
+                    apply_translation(text, text)
+                return
 
-            itext.set('CH', translated)
-            count += 1
-            print(f"{text_info['text']} -> {translated} : {count}/{total_texts} texts: {round(count/total_texts*100, 2)}%")
-        
-        # Write the modified XML to file
-        tree.write(output_file, encoding='utf-8', xml_declaration=True)
+            batch_translations = {}
+            unpacked_texts = []
+            for text, translation in zip(texts, translated):
+                if apply_translation(text, translation):
+                    batch_translations[text] = translation
+                else:
+                    unpacked_texts.append(text)
+
+            if self.cache is not None:
+                self.cache.set(batch_translations, target_lang, source_lang)
+
+            # DeepL did not keep all the delimiters of these packed texts, their runs are translated one by one
+            for packed_text in unpacked_texts:
+                runs = collector.packed_texts[packed_text]
+                pending_runs = [run for run in dict.fromkeys(runs) if not get_future(translations, run).done()]
+                if pending_runs:
+                    await translate_batch(pending_runs)
+                set_future(packed_translations, packed_text, [await get_future(translations, run) for run in runs])
+
+        async def consume():
+            done = False
+            while not done:
+                # Wait for a text, then take the ones already queued to fill the batch
+                texts = [await queue.get()]
+                while len(texts) < self.max_batch_texts and not queue.empty():
+                    texts.append(queue.get_nowait())
+                if texts[-1] is None:
+                    texts.pop()
+                    await queue.put(None)
+                    done = True
+                for batch in self.make_batches(texts):
+                    await translate_batch(batch)
+
+        # The output is written to a temporary file next to it and moved to the output path once complete,
+        # so that the input file can be translated in place while it is parsed again
+        output_path = Path(output_file)
+        with tempfile.NamedTemporaryFile(dir=output_path.parent, prefix=f".{output_path.name}.", suffix='.tmp', delete=False) as temp_file:
+            temp_path = temp_file.name
+        # The temporary file is only readable by its owner, the output gets the permissions of the input
+        shutil.copymode(input_path, temp_path)
+
+        async def write():
+            with ET.xmlfile(temp_path, encoding='utf-8') as xf:
+                xf.write_declaration()
+                writer = TranslatedWriter(xf, get_translation, report)
+                await parse(ET.XMLParser(target=writer, huge_tree=True), writer.write_events)
+
+        self._limiter = AIMDLimiter(max_limit=self.concurrency)
+        self._http_version = None
+
+        # A single client is shared by all batches so that connections are reused.
+        # The limiter starts with a single request in flight, so the first request opens one HTTP/2 connection
+        # on which the next concurrent requests are multiplexed. Connections are not limited to one because
+        # requests would be serialized if the server falls back to HTTP/1.1
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        try:
+            async with httpx.AsyncClient(http2=True, timeout=30.0, limits=limits, headers=self._auth_header) as client:
+                self._client = client
+                await asyncio.gather(produce(), write(), *[consume() for _ in range(self.concurrency)])
+            # The writer may finish before the total is known, the summary is printed once everything is done
+            percentage = count * 100 / collector.total if collector.total else 100
+            print(f"{count}/{collector.total} texts: {percentage:.2f}%")
+            # The output path is only replaced once the whole file is translated,
+            # a failed run never leaves a truncated file behind
+            os.replace(temp_path, output_path)
+        finally:
+            self._client = None
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
 
     def print_supported_languages(self, typpe : str):
         languages = None
@@ -188,7 +823,9 @@ def main():
     parser.add_argument('-s', '--source', required=False, help='Source language code (e.g., "EN", "FR", "ES")')
     parser.add_argument('-k', '--api_key', required=False, help='DeepL API key')
     parser.add_argument('-r', '--retry', required=False, help='Number of retries for failed translations', type=int, default=5)
-    parser.add_argument('-d', '--delay', required=False, help='Delay between retries in seconds', type=int, default=1)
+    parser.add_argument('-d', '--delay', required=False, help='Base delay between retries in seconds, doubled after each retry', type=int, default=1)
+    parser.add_argument('-c', '--concurrency', required=False, help='Maximum number of concurrent requests', type=int, default=16)
+    parser.add_argument('-n', '--no-cache', required=False, help='Do not use the translations cache', action='store_true')
     parser.add_argument('-l', '--list', required=False, help='List supported languages <source|target>', type=str)
 
     args=parser.parse_args()
@@ -219,7 +856,7 @@ def main():
             exit(1)
         translator.target_language = args.target
     else:
-        print("Please provide target language code using -t or --targetlanguage argument")
+        print("Please provide target language code using -t or --target argument")
         exit(1)
 
     if args.source:
@@ -238,18 +875,27 @@ def main():
             exit(1)
 
     # Verify retry and delay values
-    if args.retry:
+    if args.retry is not None:
         if args.retry < 0:
             print("Number of retries must be a positive number")
             exit(1)
         translator.max_retries = args.retry
     
-    if args.delay:
+    if args.delay is not None:
         if args.delay < 0:
             print("Delay must be a positive number")
             exit(1)
         translator.retry_delay = args.delay
+
+    if args.concurrency is not None:
+        if args.concurrency < 1:
+            print("Concurrency must be at least 1")
+            exit(1)
+        translator.concurrency = args.concurrency
     
+    if not args.no_cache:
+        translator.cache = TranslationCache()
+
     # Define input and output files
     input_file = args.file
 
@@ -260,7 +906,9 @@ def main():
         output_file = args.output
     
     # Translate file
-    translator.translate_file(input_file, output_file, translator.target_language, translator.source_language)
+    asyncio.run(translator.translate_file(input_file, output_file, translator.target_language, translator.source_language))
+    if translator.cache is not None:
+        translator.cache.close()
     print(f"Translation completed. Output saved to {output_file}")
 
 if __name__ == "__main__":